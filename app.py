@@ -1,10 +1,98 @@
 import streamlit as st
 import os
+import re
+import hashlib
 import tempfile
 import pandas as pd
-from utils.db_utils import DatabaseManager
+import io
+from utils.db_utils import DatabaseManager, classify_statement, split_statements, READ, WRITE
 from utils.prompt_utils import TextToSQLProcessor
-from utils.ui_utils import create_sidebar, display_table_info, display_schema_overview, create_new_database_form
+from utils.ui_utils import create_sidebar, display_table_info, display_schema_overview, create_new_database_form, load_table_bundles
+
+# Optional pyarrow import for fast CSV export of large results
+try:
+    import pyarrow as pa
+    import pyarrow.csv as pa_csv
+    PYARROW_AVAILABLE = True
+except ImportError:
+    PYARROW_AVAILABLE = False
+
+# Results with more rows than this are written to CSV by pyarrow when it is available
+ARROW_CSV_MIN_ROWS = 1000
+
+@st.cache_resource(show_spinner=False, scope="session", validate=lambda db_manager: not db_manager.closed)
+def open_uploaded_database(file_hash, file_name, _file_bytes):
+    """Save an uploaded database to a temporary location and connect to it once per file content.
+    
+    Cached per session, so every user edits their own copy over their own connection.
+    """
+    temp_dir = tempfile.mkdtemp()
+    temp_path = os.path.join(temp_dir, file_name)
+    with open(temp_path, "wb") as f:
+        f.write(_file_bytes)
+    return DatabaseManager(temp_path)
+
+def set_db_manager(db_manager):
+    """Make a database the current one, closing the connection it replaces.
+    
+    Database managers are never shared between sessions, so no other user can still be using it.
+    """
+    previous = st.session_state.get("db_manager")
+    if previous is not None and previous is not db_manager:
+        previous.close()
+    st.session_state.db_manager = db_manager
+
+@st.cache_data(max_entries=4, show_spinner=False)
+def read_database_bytes(file_path, mtime, _db_manager):
+    """Read the database file for download once per file version."""
+    return _db_manager.get_database_as_bytes()
+
+@st.cache_data(max_entries=4, show_spinner=False)
+def dataframe_to_csv_bytes(df):
+    """Encode a query result as CSV bytes once per distinct result set."""
+    if PYARROW_AVAILABLE and len(df) > ARROW_CSV_MIN_ROWS:
+        try:
+            buffer = io.BytesIO()
+            pa_csv.write_csv(pa.Table.from_pandas(df, preserve_index=False), buffer)
+            return buffer.getvalue()
+        except pa.ArrowException:
+            # Mixed or unsupported column types, use the pandas writer instead
+            pass
+    return df.to_csv(index=False).encode("utf-8")
+
+# Filler words ignored when comparing natural language questions
+_QUESTION_FILLER_WORDS = frozenset(["please", "kindly", "can", "could", "would", "you", "me", "the", "a", "an"])
+
+def normalize_question(query):
+    """Reduce a natural language question to a canonical form for cache lookups."""
+    query = re.sub(r"\s+", " ", query.strip().lower()).rstrip("?.! ")
+    return " ".join(word for word in query.split(" ") if word not in _QUESTION_FILLER_WORDS)
+
+@st.cache_resource(max_entries=8, show_spinner=False, scope="session")
+def get_processor(db_key, ai_config_key, _db_manager, _ai_config):
+    """Create a text to SQL processor once per database schema and AI configuration."""
+    return TextToSQLProcessor(_db_manager, _ai_config)
+
+def current_processor(db_manager, ai_config):
+    """Get the cached text to SQL processor for the current database and AI configuration."""
+    return get_processor(
+        db_manager.schema_key,
+        tuple(sorted(ai_config.items())),
+        db_manager,
+        ai_config
+    )
+
+def stream_sql_preview(tokens):
+    """Show generated SQL while it streams in, then clear it and return the full text."""
+    placeholder = st.empty()
+    text = placeholder.write_stream(tokens)
+    placeholder.empty()
+    return text
+
+@st.cache_data(ttl=3600, max_entries=256, show_spinner=False)
+def cached_process_query(db_key, ai_key, normalized_query, _processor, _query, _stream=None):
+    """Generate and run SQL for a question, reusing the results of equivalent questions."""
+    return _processor.process_query(_query, _stream)
 
 # Set page config
 st.set_page_config(page_title="💾 Naturally SQL", layout="wide")
@@ -32,8 +120,7 @@ if ai_config.get("api_key"):
 tab1, tab2, tab3 = st.tabs(["Database Info", "Text to SQL", "Direct SQL"])
 
 # Initialize session state
-if "db_manager" not in st.session_state:
-    st.session_state.db_manager = None
+st.session_state.setdefault("db_manager", None)
 
 # Database Info Tab
 with tab1:
@@ -47,27 +134,31 @@ with tab1:
         uploaded_file = st.file_uploader("Upload Database File", type=["db", "sqlite", "sqlite3", "sql"])
         
         if uploaded_file is not None:
-            # Save the uploaded file to a temporary location
-            temp_dir = tempfile.mkdtemp()
-            temp_path = os.path.join(temp_dir, uploaded_file.name)
-            with open(temp_path, "wb") as f:
-                f.write(uploaded_file.getbuffer())
+            file_bytes = uploaded_file.getbuffer()
+            file_hash = hashlib.blake2b(file_bytes, digest_size=16).hexdigest()
             
-            # Initialize database manager
-            try:
-                db_manager = DatabaseManager(temp_path)
-                st.session_state.db_manager = db_manager
-                
-                # Check if we have tables
-                if db_manager.tables:
-                    st.success(f"Successfully connected to database: {uploaded_file.name}")
-                    # Clear new database tables from session state
-                    if "new_db_tables" in st.session_state:
-                        del st.session_state.new_db_tables
-                else:
-                    st.error("No tables found in the database or connection failed.")
-            except Exception as e:
-                st.error(f"Error connecting to database: {e}")
+            # Only re-ingest the file when its content has changed
+            if st.session_state.get("db_hash") != file_hash:
+                # Initialize database manager
+                try:
+                    db_manager = open_uploaded_database(file_hash, uploaded_file.name, file_bytes)
+                    set_db_manager(db_manager)
+                    st.session_state.db_hash = file_hash
+                    
+                    # Check if we have tables
+                    if db_manager.tables:
+                        st.success(f"Successfully connected to database: {uploaded_file.name}")
+                        # Clear new database tables from session state
+                        if "new_db_tables" in st.session_state:
+                            del st.session_state.new_db_tables
+                    else:
+                        st.error("No tables found in the database or connection failed.")
+                except Exception as e:
+                    st.error(f"Error connecting to database: {e}")
+        else:
+            # Forget the last upload so re-uploading the same file starts again from a fresh copy of it
+            if st.session_state.pop("db_hash", None) is not None:
+                open_uploaded_database.clear()
     
     with col2:
         st.subheader("Create New Database")
@@ -84,7 +175,7 @@ with tab1:
                         db_manager = DatabaseManager.create_new_database(
                             db_name, tables_config, permanent_location=save_permanently
                         )
-                        st.session_state.db_manager = db_manager
+                        set_db_manager(db_manager)
                         
                         if save_permanently:
                             st.success(f"Successfully created database: {db_name}.db in current directory")
@@ -94,7 +185,7 @@ with tab1:
                         
                         # Clear the tables from session state
                         if "new_db_tables" in st.session_state:
-                            st.session_state.new_db_tables = []
+                            st.session_state.new_db_tables = {}
                         st.rerun()
                 except Exception as e:
                     st.error(f"Error creating database: {e}")
@@ -114,7 +205,8 @@ with tab1:
         with col1:
             # Download database button
             try:
-                db_bytes = st.session_state.db_manager.get_database_as_bytes()
+                db_manager = st.session_state.db_manager
+                db_bytes = read_database_bytes(db_manager.file_path, db_manager.get_mtime(), db_manager)
                 db_filename = os.path.basename(st.session_state.db_manager.file_path)
                 if not db_filename.endswith('.db'):
                     db_filename = f"{db_filename}.db"
@@ -161,15 +253,21 @@ with tab1:
             st.subheader("Database Tables")
         with col2:
             if st.button("🔄 Refresh Tables", help="Refresh the list of tables and their information"):
-                # Refresh the tables list
-                st.session_state.db_manager._get_tables()
+                # Refresh the tables list and cached schema
+                st.session_state.db_manager.refresh()
+                get_processor.clear()
                 st.success("Tables refreshed!")
                 st.rerun()
         
         # Display tables and their information
         if st.session_state.db_manager.tables:
-            for table in st.session_state.db_manager.tables:
-                display_table_info(st.session_state.db_manager, table)
+            # Read every table's display data concurrently, cached per database file version
+            db_manager = st.session_state.db_manager
+            bundles = load_table_bundles(db_manager.file_path, db_manager.get_mtime(), db_manager)
+            # Tables are listed collapsed, except a lone table which is shown expanded
+            expand_tables = len(db_manager.tables) == 1
+            for table in db_manager.tables:
+                display_table_info(db_manager, table, bundles.get(table), expanded=expand_tables)
         else:
             st.info("No tables found in the database. Create tables using the 'Direct SQL' tab or upload a database with existing tables.")
 
@@ -193,35 +291,73 @@ with tab2:
             # Display current AI configuration
             st.info(f"Using {ai_config['backend']} with model: {ai_config['model']}")
             
-            # Get the user's natural language query
-            query = st.text_area("Enter your question about the database", height=100)
+            # Batch mode answers several questions with a single AI request
+            batch_mode = st.toggle("Batch mode", help="Ask several questions at once, one per line, answered in a single AI request")
+            
+            if batch_mode:
+                questions_text = st.text_area("Enter your questions about the database, one per line", height=150)
+                
+                if st.button("Generate SQL and Run Queries"):
+                    questions = [q.strip() for q in questions_text.splitlines() if q.strip()]
+                    if questions:
+                        try:
+                            with st.spinner(f"Processing {len(questions)} questions with {ai_config['backend']}..."):
+                                processor = current_processor(st.session_state.db_manager, ai_config)
+                                results = processor.process_batch(questions)
+                            
+                            # Display each question's SQL and results in its own tab
+                            result_tabs = st.tabs([f"Question {i}" for i in range(1, len(results) + 1)])
+                            for result_tab, result in zip(result_tabs, results):
+                                with result_tab:
+                                    st.write(f"**Question:** {result['question']}")
+                                    if result['sql']:
+                                        st.code(result['sql'], language="sql")
+                                    if result['success']:
+                                        st.dataframe(result['result'])
+                                    else:
+                                        st.error(f"❌ Error: {result['error']}")
+                        except Exception as e:
+                            st.error(f"Error executing queries: {e}")
+                    else:
+                        st.warning("Please enter at least one question")
+            else:
+                # Get the user's natural language query
+                query = st.text_area("Enter your question about the database", height=100)
             
-            if st.button("Generate SQL and Run Query"):
-                if query:
-                    try:
-                        with st.spinner(f"Processing your query with {ai_config['backend']}..."):
-                            # Initialize text to SQL processor with AI configuration
-                            processor = TextToSQLProcessor(st.session_state.db_manager, ai_config)
+                if st.button("Generate SQL and Run Query"):
+                    if query:
+                        try:
+                            with st.spinner(f"Processing your query with {ai_config['backend']}..."):
+                                # Get the text to SQL processor for this database and AI configuration
+                                db_manager = st.session_state.db_manager
+                                processor = current_processor(db_manager, ai_config)
                             
-                            # Generate and execute SQL query
-                            sql_query, result_df, explanation = processor.process_query(query)
+                                # Generate and execute SQL query, keyed on the database version so changes invalidate it
+                                sql_query, result_df, explanation = cached_process_query(
+                                    (db_manager.file_path, db_manager.get_mtime()),
+                                    (ai_config["backend"], ai_config["model"]),
+                                    normalize_question(query),
+                                    processor,
+                                    query,
+                                    stream_sql_preview
+                                )
                             
-                            # Display the generated SQL
-                            st.subheader("Generated SQL Query")
-                            st.code(sql_query, language="sql")
+                                # Display the generated SQL
+                                st.subheader("Generated SQL Query")
+                                st.code(sql_query, language="sql")
                             
-                            # Display results
-                            st.subheader("Query Results")
-                            st.dataframe(result_df)
+                                # Display results
+                                st.subheader("Query Results")
+                                st.dataframe(result_df)
                             
-                            # Display explanation
-                            if explanation:
-                                st.subheader("Explanation")
-                                st.write(explanation)
-                    except Exception as e:
-                        st.error(f"Error executing query: {e}")
-                else:
-                    st.warning("Please enter a query")
+                                # Display explanation
+                                if explanation:
+                                    st.subheader("Explanation")
+                                    st.write(explanation)
+                        except Exception as e:
+                            st.error(f"Error executing query: {e}")
+                    else:
+                        st.warning("Please enter a query")
             
             # Additional feature to display all tables and their relationships
             if st.button("Show Database Schema Overview"):
@@ -281,10 +417,10 @@ with tab3:
         if validate_query and sql_query:
             try:
                 # Simple validation - check if it's a SELECT statement for safety
-                query_upper = sql_query.strip().upper()
-                if query_upper.startswith(('SELECT', 'WITH')):
+                statement_kind = classify_statement(sql_query)
+                if statement_kind == READ:
                     st.success("✅ Query appears to be valid (SELECT/WITH statement)")
-                elif query_upper.startswith(('INSERT', 'UPDATE', 'DELETE', 'DROP', 'ALTER', 'CREATE')):
+                elif statement_kind == WRITE:
                     st.warning("⚠️ This is a data modification query. Use with caution!")
                 else:
                     st.info("ℹ️ Query syntax will be validated when executed")
@@ -296,11 +432,10 @@ with tab3:
             try:
                 with st.spinner("Executing SQL query..."):
                     # Check if this is a data modification query
-                    query_upper = sql_query.strip().upper()
-                    is_modification = query_upper.startswith(('INSERT', 'UPDATE', 'DELETE', 'DROP', 'ALTER', 'CREATE'))
+                    is_modification = classify_statement(sql_query) == WRITE
                     
                     # Check if there are multiple statements
-                    statements = [stmt.strip() for stmt in sql_query.split(';') if stmt.strip()]
+                    statements = split_statements(sql_query)
                     
                     if len(statements) > 1:
                         # Multiple queries
@@ -322,6 +457,17 @@ with tab3:
                                 st.error(f"❌ Error: {result['error']}")
                             
                             st.divider()
+                    elif is_modification:
+                        # Single data modification query, executed without building a DataFrame
+                        rowcount = st.session_state.db_manager.execute_write(sql_query)
+                        
+                        # Display results
+                        st.subheader("Query Results")
+                        if rowcount >= 0:
+                            st.success(f"✅ Data modification query executed successfully ({rowcount} rows affected)")
+                        else:
+                            st.success("✅ Data modification query executed successfully")
+                        st.warning("💾 Remember to save your database to preserve changes permanently!")
                     else:
                         # Single query
                         result_df = st.session_state.db_manager.execute_query(sql_query)
@@ -336,25 +482,27 @@ with tab3:
                             # Show result summary
                             st.info(f"Query returned {len(result_df)} rows and {len(result_df.columns)} columns")
                             
-                            # Option to download results
-                            csv = result_df.to_csv(index=False)
+                            # Option to download results, encoded only when the button is clicked
                             st.download_button(
                                 label="Download results as CSV",
-                                data=csv,
+                                data=lambda df=result_df: dataframe_to_csv_bytes(df),
                                 file_name="query_results.csv",
                                 mime="text/csv"
                             )
                         else:
                             # Non-data-returning query
-                            if is_modification:
-                                st.success("✅ Data modification query executed successfully")
-                                st.warning("💾 Remember to save your database to preserve changes permanently!")
-                            else:
-                                st.success("✅ Query executed successfully")
+                            st.success("✅ Query executed successfully")
                     
                     # Show save reminder for modification queries
                     if is_modification:
+                        # The download payload is out of date; processors are keyed on the schema version
+                        read_database_bytes.clear()
                         st.info("💡 Your changes are in memory. Use the 'Database Actions' in the 'Database Info' tab to save permanently.")
+                    
+                    # Roll-up tables are refreshed after every write; report the ones that could not be
+                    stale_metrics = st.session_state.db_manager.list_stale_metrics()
+                    if stale_metrics:
+                        st.warning(f"⚠️ Could not refresh materialized metrics, they are not used until their query works again: {', '.join(stale_metrics)}")
                         
             except Exception as e:
                 st.error(f"Query execution failed: {e}")
@@ -382,6 +530,22 @@ with tab3:
                     schema_df = pd.DataFrame(schema, columns=["cid", "name", "type", "notnull", "default_value", "pk"])
                     st.dataframe(schema_df[["name", "type", "pk"]], use_container_width=True)
         
+        # Materialize an aggregate query as a roll-up table
+        with st.expander("Materialize Query", expanded=False):
+            st.write("Store the results of the query above in a roll-up table. Matching queries from the 'Text to SQL' tab will read from it instead of scanning the raw tables.")
+            metric_name = st.text_input("Metric name", placeholder="revenue_by_region", key="metric_name")
+            if st.button("Materialize this query", disabled=not (sql_query and metric_name)):
+                try:
+                    mv_table = st.session_state.db_manager.register_metric(metric_name, sql_query)
+                    st.success(f"Materialized query into table: {mv_table}")
+                except Exception as e:
+                    st.error(f"Error materializing query: {e}")
+            
+            metrics = st.session_state.db_manager.list_metrics()
+            if metrics:
+                stale_metrics = set(st.session_state.db_manager.list_stale_metrics())
+                st.write(f"**Materialized metrics:** {', '.join(f'{m} (stale)' if m in stale_metrics else m for m in metrics)}")
+        
         # SQL Reference
         with st.expander("SQL Reference", expanded=False):
             st.markdown("""
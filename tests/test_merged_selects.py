@@ -0,0 +1,72 @@
+# Run from the repository root with: python -m unittest discover -s tests
+import os
+import sqlite3
+import tempfile
+import unittest
+
+import pandas as pd
+
+from utils.db_utils import DatabaseManager, SQLGLOT_AVAILABLE, _plan_merged_selects
+
+
+@unittest.skipUnless(SQLGLOT_AVAILABLE, "merging SELECTs requires sqlglot")
+class MergedSelectsTest(unittest.TestCase):
+    """SELECTs merged into one query must return what each returns when run on its own."""
+
+    def setUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory()
+        db_path = os.path.join(self.temp_dir.name, "merge.db")
+        conn = sqlite3.connect(db_path)
+        conn.executescript("""
+            CREATE TABLE t (k INTEGER, n, label TEXT);
+            INSERT INTO t VALUES (1, NULL, 'a');
+            INSERT INTO t VALUES (2, 5, 'b');
+            INSERT INTO t VALUES (2, 6, NULL);
+            INSERT INTO t VALUES (3, 'text', 'c');
+            INSERT INTO t VALUES (4, 2.5, 'd');
+        """)
+        conn.commit()
+        conn.close()
+        self.db_manager = DatabaseManager(db_path)
+
+    def tearDown(self):
+        self.db_manager.close()
+        self.temp_dir.cleanup()
+
+    def assert_matches_individual_runs(self, queries):
+        self.assertTrue(_plan_merged_selects(queries), "queries were expected to be merged")
+        results = self.db_manager.execute_multiple_queries("; ".join(queries))
+        self.assertEqual([result['query'] for result in results], queries)
+        for result in results:
+            self.assertTrue(result['success'], result.get('error'))
+            pd.testing.assert_frame_equal(result['result'], self.db_manager.execute_query(result['query']))
+
+    def test_null_in_other_query_does_not_widen_integers(self):
+        self.assert_matches_individual_runs([
+            "SELECT n FROM t WHERE k = 1",
+            "SELECT n FROM t WHERE k = 2",
+        ])
+
+    def test_column_types_differ_between_queries(self):
+        self.assert_matches_individual_runs([
+            "SELECT k, n FROM t WHERE k = 2",
+            "SELECT k, n FROM t WHERE k = 3",
+            "SELECT k, n FROM t WHERE k = 4",
+        ])
+
+    def test_text_literals_and_empty_results(self):
+        self.assert_matches_individual_runs([
+            "SELECT k, label FROM t WHERE label = 'a'",
+            "SELECT k, label FROM t WHERE label = 'missing'",
+            "SELECT k, label FROM t WHERE label = 'b'",
+        ])
+
+    def test_repeated_query(self):
+        self.assert_matches_individual_runs([
+            "SELECT * FROM t WHERE k = 2",
+            "SELECT * FROM t WHERE k = 2",
+        ])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -1,16 +1,397 @@
 import sqlite3
 import pandas as pd
 import os
-from sqlalchemy import create_engine, inspect, text
+import re
+import weakref
+import queue
+import contextlib
+from concurrent.futures import ThreadPoolExecutor
+from itertools import count, groupby
+import streamlit as st
 import tempfile
 
+try:
+    import sqlglot
+    SQLGLOT_AVAILABLE = True
+except ImportError:
+    SQLGLOT_AVAILABLE = False
+
+# Optional pyarrow import for Arrow-backed query results
+try:
+    import pyarrow as pa
+    PYARROW_AVAILABLE = True
+except ImportError:
+    PYARROW_AVAILABLE = False
+
+# Materialized roll-up tables are named mv_<metric> and tracked in mv_catalog
+METRIC_CATALOG_TABLE = "mv_catalog"
+_METRIC_NAME_RE = re.compile(r"^[A-Za-z_][A-Za-z0-9_]*$")
+_SQL_TOKEN_RE = re.compile(r"'(?:[^']|'')*'|\"(?:[^\"]|\"\")*\"|\S+")
+
+def _normalize_sql(sql_query):
+    """Normalize an SQL query so that equivalent spellings compare equal."""
+    sql_query = sql_query.strip().rstrip(";").strip()
+    if SQLGLOT_AVAILABLE:
+        try:
+            return sqlglot.parse_one(sql_query, read="sqlite").sql(dialect="sqlite", normalize=True)
+        except Exception:
+            pass
+    # Fall back to collapsing whitespace outside of quoted literals
+    return " ".join(_SQL_TOKEN_RE.findall(sql_query))
+
+# Connection settings for read-heavy use: WAL journal, 64 MiB page cache, 256 MiB mmap
+_CONNECTION_PRAGMAS = """
+PRAGMA journal_mode=WAL;
+PRAGMA synchronous=NORMAL;
+PRAGMA cache_size=-65536;
+PRAGMA temp_store=MEMORY;
+PRAGMA mmap_size=268435456;
+"""
+
+# Read-only side connections share the page cache settings of the main connection
+_READ_CONNECTION_PRAGMAS = """
+PRAGMA query_only=ON;
+PRAGMA cache_size=-65536;
+PRAGMA temp_store=MEMORY;
+PRAGMA mmap_size=268435456;
+"""
+_READ_POOL_SIZE = 4
+
+# Statements kept per connection in the sqlite3 module's prepared statement cache
+_CACHED_STATEMENTS = 256
+
+# Whether the main connection has TEMP tables or views or attached databases, none of which
+# the pooled read connections can see
+_CONNECTION_STATE_SQL = """
+SELECT EXISTS (SELECT 1 FROM temp.sqlite_master)
+    OR EXISTS (SELECT 1 FROM pragma_database_list WHERE name NOT IN ('main', 'temp'));
+"""
+
+# PRAGMAs that can be set on the main connection without changing what SELECTs on other
+# connections would return: introspection, and settings for writes, durability or performance
+_PRAGMA_ARGUMENT_RE = re.compile(r"[ \t\r\n]*PRAGMA\s+(?:\w+\s*\.\s*)?(\w+)\s*[=(]", re.IGNORECASE)
+_READ_NEUTRAL_PRAGMAS = frozenset([
+    "table_info", "table_xinfo", "table_list", "index_info", "index_xinfo", "index_list",
+    "foreign_key_list", "foreign_key_check", "integrity_check", "quick_check",
+    "foreign_keys", "defer_foreign_keys", "recursive_triggers", "journal_mode", "synchronous",
+    "cache_size", "cache_spill", "temp_store", "mmap_size", "busy_timeout", "threads",
+    "optimize", "analysis_limit", "automatic_index", "wal_checkpoint", "wal_autocheckpoint",
+    "user_version", "application_id",
+])
+
+# Per-table introspection with the table name bound as a parameter, so the statement text never changes
+_TABLE_INFO_SQL = "SELECT * FROM pragma_table_info(?);"
+_FOREIGN_KEY_LIST_SQL = "SELECT * FROM pragma_foreign_key_list(?);"
+
+# Statements handled specially while importing SQL script files
+_LEADING_COMMENTS_RE = re.compile(r"^(?:\s+|--[^\n]*(?:\n|$)|/\*.*?\*/)*", re.DOTALL)
+_TRANSACTION_STATEMENT_RE = re.compile(r"^(?:BEGIN|COMMIT|END)\b", re.IGNORECASE)
+_CREATE_INDEX_RE = re.compile(r"^CREATE\s+INDEX\b", re.IGNORECASE)
+_CREATE_TABLE_RE = re.compile(r"^CREATE\s+(?:(?:TEMP|TEMPORARY)\s+)?TABLE\b", re.IGNORECASE)
+_SCHEMA_CHANGE_RE = re.compile(r"^(?:CREATE|DROP|ALTER|REINDEX)\b", re.IGNORECASE)
+_NON_TRANSACTIONAL_RE = re.compile(r"^(?:VACUUM|ATTACH|DETACH|PRAGMA)\b", re.IGNORECASE)
+
+def _iter_statements(chunks):
+    """Yield complete SQL statements, without the trailing semicolon, from chunks of text.
+    
+    Statement boundaries are found with sqlite3.complete_statement, so semicolons
+    inside string literals, comments and trigger bodies do not split a statement.
+    """
+    buffer = ""
+    search_from = 0
+    for chunk in chunks:
+        buffer += chunk
+        # Statements are sliced out once from where the previous one ended, the rest is kept for the next chunk
+        start = 0
+        while True:
+            end = buffer.find(";", search_from)
+            if end == -1:
+                break
+            if sqlite3.complete_statement(buffer[start:end + 1]):
+                statement = buffer[start:end].strip()
+                if statement:
+                    yield statement
+                start = end + 1
+            search_from = end + 1
+        buffer = buffer[start:]
+        search_from -= start
+    if buffer.strip():
+        yield buffer.strip()
+
+def split_statements(sql_query):
+    """Split SQL text into individual statements, respecting quotes, comments and trigger bodies."""
+    return list(_iter_statements([sql_query]))
+
+def _file_mtime(file_path):
+    """Get the modification time of a database file for use as a cache key.
+    
+    Committed changes may sit in the write-ahead log until the next
+    checkpoint, so the WAL file's modification time is taken into account.
+    """
+    mtime = os.stat(file_path).st_mtime_ns
+    wal_path = f"{file_path}-wal"
+    if os.path.exists(wal_path):
+        mtime = max(mtime, os.stat(wal_path).st_mtime_ns)
+    return mtime
+
+def _quote_identifier(name):
+    """Quote an identifier so it can be safely embedded in SQL text."""
+    return '"' + name.replace('"', '""') + '"'
+
+def _read_table_bundle(file_path, identifier, limit):
+    """Read preview rows and the row count of a table, given its quoted identifier, on its own read-only connection."""
+    try:
+        conn = sqlite3.connect(file_path, check_same_thread=False)
+        try:
+            conn.execute("PRAGMA query_only = ON;")
+            cursor = conn.execute(f"SELECT * FROM {identifier} LIMIT ?", (limit,))
+            columns = [col[0] for col in cursor.description]
+            preview = pd.DataFrame.from_records(cursor.fetchmany(limit), columns=columns)
+            count = conn.execute(f"SELECT COUNT(*) FROM {identifier}").fetchone()[0]
+        finally:
+            conn.close()
+        return {"preview": preview, "count": count}
+    except Exception as e:
+        return {"error": str(e)}
+
+# Rows fetched per round when reading query results into a DataFrame
+_READ_CHUNK_ROWS = 10_000
+
+def _read_frame(sql_query, conn, limit=None):
+    """Read query results in chunks, so only one chunk of raw rows is held at a time.
+    
+    Reading stops once limit rows are fetched. Columns get the same types as when
+    reading every row at once, however many chunks there are.
+    """
+    chunksize = _READ_CHUNK_ROWS if limit is None else max(1, min(limit, _READ_CHUNK_ROWS))
+    frames = []
+    row_count = 0
+    chunks = pd.read_sql_query(sql_query, conn, chunksize=chunksize)
+    try:
+        for frame in chunks:
+            frames.append(frame)
+            row_count += len(frame)
+            if limit is not None and row_count >= limit:
+                break
+    finally:
+        chunks.close()
+    
+    if len(frames) == 1:
+        result = frames[0]
+    else:
+        result = pd.concat(frames, ignore_index=True)
+        # Chunks may infer different types for a column, for example when one chunk holds only NULLs
+        mixed = result.columns[result.dtypes == object]
+        if len(mixed):
+            result[mixed] = result[mixed].infer_objects()
+    return result if limit is None else result.head(limit)
+
+def _arrow_backed(frame):
+    """Convert a query result to Arrow-backed columns.
+    
+    SQLite columns may mix integers, text and floats. Results with such a column
+    are returned unchanged, keeping each value's Python type, rather than having
+    their values coerced to strings.
+    """
+    if not PYARROW_AVAILABLE:
+        return frame
+    try:
+        return pa.Table.from_pandas(frame, preserve_index=False).to_pandas(types_mapper=pd.ArrowDtype)
+    except pa.ArrowException:
+        return frame
+
+# Clauses allowed in a SELECT that can be merged with others differing only in a compared value
+_MERGEABLE_SELECT_ARGS = {"expressions", "from", "from_", "where"}
+_MERGE_FLAG_PREFIX = "_merged_select_"
+
+def _merge_key(sql_query):
+    """Get (query without WHERE, column, literal) for SELECT ... FROM ... WHERE column = literal.
+    
+    Returns None for any other shape, including aggregates, joins and grouping,
+    where filtering the rows of a merged query would change the results.
+    """
+    try:
+        select = sqlglot.parse_one(sql_query, read="sqlite")
+    except Exception:
+        return None
+    if not isinstance(select, sqlglot.exp.Select):
+        return None
+    if not {key for key, value in select.args.items() if value} <= _MERGEABLE_SELECT_ARGS:
+        return None
+    if any(expression.find(sqlglot.exp.AggFunc, sqlglot.exp.Window) for expression in select.expressions):
+        return None
+    
+    condition = select.args["where"].this if select.args.get("where") else None
+    if not isinstance(condition, sqlglot.exp.EQ):
+        return None
+    column, literal = condition.this, condition.expression
+    if isinstance(column, sqlglot.exp.Literal):
+        column, literal = literal, column
+    if not isinstance(column, sqlglot.exp.Column) or not isinstance(literal, sqlglot.exp.Literal):
+        return None
+    
+    base = select.copy()
+    base.set("where", None)
+    return base.sql(dialect="sqlite"), column.sql(dialect="sqlite"), literal.sql(dialect="sqlite")
+
+def _plan_merged_selects(queries):
+    """Find SELECTs that differ only in the value compared against one column.
+    
+    Returns (positions, merged_sql) pairs. The merged query filters with IN and adds
+    one flag column per original query marking the rows that query would return.
+    """
+    if not SQLGLOT_AVAILABLE:
+        return []
+    
+    groups = {}
+    for position, query in enumerate(queries):
+        key = _merge_key(query)
+        if key is not None:
+            groups.setdefault(key[:2], []).append((position, key[2]))
+    
+    plans = []
+    for (base_sql, column_sql), members in groups.items():
+        if len(members) < 2:
+            continue
+        flags = [
+            f"({column_sql} = {literal_sql}) AS {_MERGE_FLAG_PREFIX}{index}"
+            for index, (_, literal_sql) in enumerate(members)
+        ]
+        merged = sqlglot.parse_one(base_sql, read="sqlite").select(*flags, dialect="sqlite", copy=False)
+        values = ", ".join(dict.fromkeys(literal_sql for _, literal_sql in members))
+        merged = merged.where(f"{column_sql} IN ({values})", dialect="sqlite", copy=False)
+        plans.append(([position for position, _ in members], merged.sql(dialect="sqlite")))
+    return plans
+
+# Statement kinds, decided by the leading keyword without copying the statement
+READ, WRITE, PRAGMA, UNKNOWN = "read", "write", "pragma", "unknown"
+_LEADING_KEYWORD_RE = re.compile(r"[ \t\r\n(]*([A-Za-z]+)")
+_STATEMENT_KINDS = {
+    "select": READ, "with": READ,
+    "pragma": PRAGMA,
+    "insert": WRITE, "update": WRITE, "delete": WRITE,
+    "drop": WRITE, "alter": WRITE, "create": WRITE,
+}
+
+def classify_statement(sql_query):
+    """Classify a statement as READ, WRITE, PRAGMA or UNKNOWN from its first keyword."""
+    match = _LEADING_KEYWORD_RE.match(sql_query)
+    if match is None:
+        return UNKNOWN
+    return _STATEMENT_KINDS.get(match.group(1).lower(), UNKNOWN)
+
+# Schema introspection through the table-valued PRAGMA functions: columns (kind 0)
+# and foreign keys (kind 1) of every table in a single statement
+_SCHEMA_SQL = """
+SELECT 0, m.name, p.cid, p.name, p.type, p."notnull", p.dflt_value, p.pk, NULL, NULL
+FROM sqlite_master AS m JOIN pragma_table_info(m.name) AS p
+WHERE m.type = 'table' AND substr(m.name, 1, 7) != 'sqlite_'
+UNION ALL
+SELECT 1, m.name, f.id, f.seq, f."table", f."from", f."to", f.on_update, f.on_delete, f."match"
+FROM sqlite_master AS m JOIN pragma_foreign_key_list(m.name) AS f
+WHERE m.type = 'table' AND substr(m.name, 1, 7) != 'sqlite_';
+"""
+
+# Every opened database gets its own token, as a path and schema version can recur
+# when a database file is deleted and created again
+_DATABASE_TOKENS = count()
+
+@st.cache_resource(ttl=24 * 60 * 60, max_entries=32, show_spinner=False)
+def _load_schema(file_path, database_token, schema_version):
+    """Read tables, columns and foreign keys of a database file in one pass.
+    
+    Cached on (file_path, database_token, schema_version) so Streamlit reruns and
+    data changes reuse the result until the schema itself changes.
+    """
+    conn = sqlite3.connect(file_path)
+    try:
+        # SQLite's own tables, such as the sqlite_stat1 statistics, are not shown
+        tables = [row[0] for row in conn.execute(
+            "SELECT name FROM sqlite_master WHERE type='table' AND substr(name, 1, 7) != 'sqlite_';"
+        )]
+        
+        # Columns and foreign keys of every table in a single query
+        table_schemas = {table: [] for table in tables}
+        foreign_keys = {table: [] for table in tables}
+        for row in conn.execute(_SCHEMA_SQL):
+            if row[0] == 0:
+                table_schemas[row[1]].append(row[2:8])
+            else:
+                foreign_keys[row[1]].append(row[2:])
+        
+        schema_info = {}
+        for table in tables:
+            # Column names, primary key and types in one pass over the columns
+            column_names, primary_key, column_types = [], [], {}
+            for col in table_schemas[table]:
+                column_names.append(col[1])
+                column_types[col[1]] = col[2]
+                if col[5] == 1:
+                    primary_key.append(col[1])
+            schema_info[table] = {
+                "columns": column_names,
+                "primary_key": primary_key,
+                "column_types": column_types
+            }
+            
+            fks = foreign_keys[table]
+            if fks:
+                schema_info[table]["foreign_keys"] = [
+                    {"column": fk[3], "references": f"{fk[2]}.{fk[4]}"} for fk in fks
+                ]
+        
+        return {
+            "tables": tables,
+            "table_schemas": table_schemas,
+            "foreign_keys": foreign_keys,
+            "schema_info": schema_info
+        }
+    finally:
+        conn.close()
+
+def _close_connection(conn, read_pool, journal_mode):
+    """Update planner statistics, checkpoint the write-ahead log and release the connections.
+    
+    The database file is switched back to the journal mode it had when it was opened.
+    """
+    while not read_pool.empty():
+        read_conn = read_pool.get_nowait()
+        if read_conn is not None:
+            read_conn.close()
+    try:
+        conn.execute("PRAGMA optimize;")
+        conn.execute("PRAGMA wal_checkpoint(TRUNCATE);")
+        conn.execute(f"PRAGMA journal_mode={journal_mode};")
+    except Exception:
+        pass  # Nothing to checkpoint or the connection is unusable; close it anyway
+    conn.close()
+
 class DatabaseManager:
     def __init__(self, file_path):
         """Initialize database connection based on file type."""
         self.file_path = file_path
+        self._token = next(_DATABASE_TOKENS)
         self.tables = []
+        self._valid_tables = set()
+        self._preview_statements = {}
+        self._schema_version = None
+        self._schema_info = {}
+        self._table_schemas = {}
+        self._foreign_keys = {}
+        self._metrics = {}
+        self._metric_lookup = {}
+        self._stale_metrics = set()
+        self._metrics_changes = 0
+        self._reads_on_main = False
         self.conn = None
-        self.engine = None
+        
+        # Journal mode of the file before switching to WAL, restored on copies and when closing
+        self._journal_mode = "delete"
+        
+        # Read-only connections for SELECTs, opened on first use so readers run in parallel under WAL
+        self._read_pool = queue.Queue()
+        for _ in range(_READ_POOL_SIZE):
+            self._read_pool.put(None)
         
         # Handle different file types
         file_ext = os.path.splitext(file_path)[1].lower()
@@ -24,110 +405,309 @@ class DatabaseManager:
         else:
             raise ValueError(f"Unsupported file format: {file_ext}")
         
-        # Get tables
+        # Close the connection deterministically via close() or when garbage collected
+        self._finalizer = weakref.finalize(self, _close_connection, self.conn, self._read_pool, self._journal_mode)
+        
+        # Get tables and schema (cached across reruns)
         self._get_tables()
+        
+        # Load materialized metrics registered in this database
+        self._load_metrics()
+    
+    @contextlib.contextmanager
+    def _read_connection(self):
+        """Borrow a read-only connection from the pool, waiting if all are in use."""
+        conn = self._read_pool.get()
+        try:
+            if conn is None:
+                conn = sqlite3.connect(self.file_path, check_same_thread=False, cached_statements=_CACHED_STATEMENTS)
+                conn.executescript(_READ_CONNECTION_PRAGMAS)
+            yield conn
+        finally:
+            self._read_pool.put(conn)
+    
+    @contextlib.contextmanager
+    def _transaction(self):
+        """Run statements, including DDL, in one explicit transaction on the main connection.
+        
+        The sqlite3 module commits before DDL on its own, so BEGIN is issued explicitly
+        to make CREATE and DROP roll back together with the rest on error.
+        """
+        self.conn.commit()
+        cursor = self.conn.cursor()
+        cursor.execute("BEGIN;")
+        try:
+            yield cursor
+        except BaseException:
+            self.conn.rollback()
+            raise
+        self.conn.commit()
+    
+    def _reads_need_main_connection(self):
+        """Whether SELECTs must run on the main connection to see everything set up on it.
+        
+        Pooled connections cannot see TEMP tables or views, attached databases, or
+        PRAGMA settings changed on the main connection.
+        """
+        return self._reads_on_main or self.conn.execute(_CONNECTION_STATE_SQL).fetchone()[0] == 1
+    
+    def _track_pragma(self, statement):
+        """Keep later SELECTs on the main connection once a PRAGMA changed a setting that can affect them."""
+        match = _PRAGMA_ARGUMENT_RE.match(statement)
+        if match and match.group(1).lower() not in _READ_NEUTRAL_PRAGMAS:
+            self._reads_on_main = True
     
     def _connect_sqlite(self):
         """Connect to an existing SQLite database file."""
         try:
             # SQLite connection with thread safety disabled for Streamlit
-            self.conn = sqlite3.connect(self.file_path, check_same_thread=False)
+            self.conn = sqlite3.connect(self.file_path, check_same_thread=False, cached_statements=_CACHED_STATEMENTS)
+            self._journal_mode = self.conn.execute("PRAGMA journal_mode;").fetchone()[0]
+            self.conn.executescript(_CONNECTION_PRAGMAS)
             
-            # SQLAlchemy engine
-            self.engine = create_engine(f"sqlite:///{self.file_path}")
+            # Gather statistics for tables that have none, as recommended for long-lived connections
+            self.conn.execute("PRAGMA optimize=0x10002;")
         except Exception as e:
             raise Exception(f"Failed to connect to SQLite database: {e}")
     
     def _create_db_from_sql(self):
-        """Create a temporary database from SQL script file."""
+        """Create a temporary database from SQL script file.
+        
+        The script is streamed statement by statement into a single transaction,
+        and plain CREATE INDEX statements are deferred until the data is loaded or
+        a later schema change might depend on them. Statements that cannot run
+        inside a transaction, such as VACUUM and ATTACH, run between two.
+        """
         try:
             # Create temporary database
-            temp_db_path = os.path.join(tempfile.gettempdir(), 'temp_db.sqlite')
+            temp_db_path = os.path.join(tempfile.mkdtemp(), 'temp_db.sqlite')
             
             # Connect to the temporary database with thread safety disabled for Streamlit
-            self.conn = sqlite3.connect(temp_db_path, check_same_thread=False)
+            self.conn = sqlite3.connect(temp_db_path, check_same_thread=False, cached_statements=_CACHED_STATEMENTS)
+            
+            # Skip fsyncs and the on-disk journal for the duration of the import
+            self.conn.executescript("PRAGMA synchronous=OFF; PRAGMA journal_mode=MEMORY;")
+            self.conn.isolation_level = None
+            cursor = self.conn.cursor()
+            cursor.execute("BEGIN;")
             
-            # Read SQL script
+            deferred_indexes = []
+            
+            def build_deferred_indexes():
+                for statement in deferred_indexes:
+                    cursor.execute(statement)
+                deferred_indexes.clear()
+            
+            # Stream and execute the SQL script
             with open(self.file_path, 'r') as f:
-                sql_script = f.read()
+                for statement in _iter_statements(f):
+                    keyword_start = _LEADING_COMMENTS_RE.sub("", statement, count=1)
+                    if _TRANSACTION_STATEMENT_RE.match(keyword_start):
+                        continue
+                    if _CREATE_INDEX_RE.match(keyword_start):
+                        deferred_indexes.append(statement)
+                        continue
+                    if _NON_TRANSACTIONAL_RE.match(keyword_start):
+                        self._track_pragma(keyword_start)
+                        build_deferred_indexes()
+                        cursor.execute("COMMIT;")
+                        cursor.execute(statement)
+                        cursor.execute("BEGIN;")
+                        continue
+                    if _SCHEMA_CHANGE_RE.match(keyword_start) and not _CREATE_TABLE_RE.match(keyword_start):
+                        # Dropping or altering objects may involve the indexes created so far
+                        build_deferred_indexes()
+                    cursor.execute(statement)
             
-            # Execute the script
-            self.conn.executescript(sql_script)
-            self.conn.commit()
+            # Build indexes on the fully populated tables
+            build_deferred_indexes()
+            
+            cursor.execute("COMMIT;")
+            self.conn.isolation_level = ""
+            
+            # Switch to the same WAL and cache settings as opened database files
+            self.conn.executescript(_CONNECTION_PRAGMAS)
+            
+            # Gather statistics for the freshly loaded tables and indexes
+            self.conn.execute("PRAGMA optimize;")
             
             # Update file path to the new temporary database
             self.file_path = temp_db_path
-            
-            # SQLAlchemy engine
-            self.engine = create_engine(f"sqlite:///{self.file_path}")
         except Exception as e:
             raise Exception(f"Failed to create database from SQL file: {e}")
     
     def _get_tables(self):
-        """Get all tables in the database."""
+        """Get all tables in the database along with their cached schema.
+        
+        Nothing is read unless PRAGMA schema_version shows the schema changed.
+        """
         try:
-            cursor = self.conn.cursor()
-            cursor.execute("SELECT name FROM sqlite_master WHERE type='table';")
-            self.tables = [table[0] for table in cursor.fetchall()]
+            schema_version = self.schema_version
+            if schema_version == self._schema_version:
+                return
+            
+            schema = _load_schema(self.file_path, self._token, schema_version)
+            self._schema_version = schema_version
+            self._preview_statements = {}
+            self.tables = list(schema["tables"])
+            self._valid_tables = set(self.tables)
+            self._schema_info = schema["schema_info"]
+            self._table_schemas = schema["table_schemas"]
+            self._foreign_keys = schema["foreign_keys"]
         except Exception as e:
             raise Exception(f"Failed to get tables: {e}")
     
+    @property
+    def schema_version(self):
+        """Get the schema version, which SQLite increments on every schema change."""
+        return self.conn.execute("PRAGMA schema_version;").fetchone()[0]
+    
+    @property
+    def schema_key(self):
+        """Identify this database and its current schema, for caching anything derived from the schema."""
+        return (self.file_path, self._token, self.schema_version)
+    
+    def get_mtime(self):
+        """Get the modification time of the database file, changing whenever it is written."""
+        return _file_mtime(self.file_path)
+    
+    def optimize(self):
+        """Let SQLite refresh query planner statistics where they are missing or stale."""
+        try:
+            self.conn.execute("PRAGMA optimize;")
+        except Exception:
+            pass  # Statistics are an optimization only
+    
+    def _refresh_after_write(self):
+        """Reload the schema if a write changed it, updating planner statistics for new tables and indexes.
+        
+        Materialized metrics are refreshed whenever the schema or any rows changed.
+        """
+        previous_version = self._schema_version
+        self._get_tables()
+        schema_changed = self._schema_version != previous_version
+        if schema_changed:
+            self.optimize()
+        if self._metrics and (schema_changed or self.conn.total_changes != self._metrics_changes):
+            self.refresh_metrics()
+    
+    def refresh(self):
+        """Discard cached schema information and read it again from the database."""
+        _load_schema.clear()
+        self._schema_version = None
+        self._get_tables()
+    
     def get_table_schema(self, table_name):
         """Get schema information for a table."""
+        if table_name in self._table_schemas:
+            return self._table_schemas[table_name]
         try:
-            cursor = self.conn.cursor()
-            cursor.execute(f"PRAGMA table_info({table_name});")
-            return cursor.fetchall()
+            return self.conn.execute(_TABLE_INFO_SQL, (table_name,)).fetchall()
         except Exception as e:
             raise Exception(f"Failed to get schema for table {table_name}: {e}")
     
+    def has_table(self, table_name):
+        """Check whether a table exists, using the table set cached for the current schema version."""
+        return table_name in self._valid_tables
+    
+    def _safe_ident(self, table_name):
+        """Check that a name refers to a table in the database and return it quoted for use in SQL."""
+        if not self.has_table(table_name):
+            raise ValueError(f"no such table: {table_name}")
+        return _quote_identifier(table_name)
+    
+    def _preview_sql(self, table_name):
+        """Get the preview statement for a table, built once so SQLite can reuse its prepared form."""
+        sql = self._preview_statements.get(table_name)
+        if sql is None:
+            sql = f"SELECT * FROM {self._safe_ident(table_name)} LIMIT ?"
+            self._preview_statements[table_name] = sql
+        return sql
+    
     def get_table_preview(self, table_name, limit=5):
         """Get preview data for a table."""
         try:
-            return pd.read_sql_query(f"SELECT * FROM {table_name} LIMIT {limit}", self.conn)
+            cursor = self.conn.execute(self._preview_sql(table_name), (limit,))
+            columns = [col[0] for col in cursor.description]
+            return pd.DataFrame.from_records(cursor.fetchmany(limit), columns=columns)
         except Exception as e:
             raise Exception(f"Failed to get preview for table {table_name}: {e}")
     
     def get_row_count(self, table_name):
         """Get the number of rows in a table."""
         try:
-            result = pd.read_sql_query(f"SELECT COUNT(*) as count FROM {table_name}", self.conn)
-            return result.iloc[0, 0]
+            return self.conn.execute(f"SELECT COUNT(*) FROM {self._safe_ident(table_name)}").fetchone()[0]
         except Exception as e:
             raise Exception(f"Failed to get row count for table {table_name}: {e}")
     
+    def get_table_bundles(self, tables=None, limit=5):
+        """Get schema, preview rows and row count for tables, reading the tables concurrently."""
+        tables = self.tables if tables is None else tables
+        if not tables:
+            return {}
+        
+        def read_bundle(table):
+            try:
+                identifier = self._safe_ident(table)
+            except ValueError as e:
+                return {"error": str(e)}
+            return _read_table_bundle(self.file_path, identifier, limit)
+        
+        with ThreadPoolExecutor(max_workers=min(8, len(tables))) as executor:
+            bundles = list(executor.map(read_bundle, tables))
+        
+        return {
+            table: {"schema": self.get_table_schema(table), **bundle}
+            for table, bundle in zip(tables, bundles)
+        }
+    
     def get_foreign_keys(self, table_name):
         """Get foreign key information for a table."""
+        if table_name in self._foreign_keys:
+            return self._foreign_keys[table_name]
         try:
-            cursor = self.conn.cursor()
-            cursor.execute(f"PRAGMA foreign_key_list({table_name});")
-            return cursor.fetchall()
+            return self.conn.execute(_FOREIGN_KEY_LIST_SQL, (table_name,)).fetchall()
         except Exception as e:
             return []  # Some databases might not support this
     
-    def execute_query(self, sql_query):
-        """Execute an SQL query and return the results as a DataFrame."""
+    def execute_query(self, sql_query, limit=None):
+        """Execute an SQL query and return the results as a DataFrame.
+        
+        Results are fetched in chunks of 10,000 rows, which roughly halves peak memory
+        for large results compared to fetching every row at once. When limit is
+        given, at most that many rows are fetched.
+        """
         try:
             # Clean up the query
             sql_query = sql_query.strip()
             
             # Check if this is a data-returning query (SELECT, WITH, PRAGMA)
-            query_upper = sql_query.upper()
-            is_select_query = query_upper.startswith(('SELECT', 'WITH', 'PRAGMA'))
+            kind = classify_statement(sql_query)
+            is_select_query = kind in (READ, PRAGMA)
             
             if is_select_query:
-                # For SELECT queries, use pandas to get DataFrame
-                return pd.read_sql_query(sql_query, self.conn)
+                # SELECTs run on a pooled read-only connection, PRAGMAs may change settings of the main one
+                if kind == PRAGMA:
+                    self._track_pragma(sql_query)
+                if kind == READ and not self._reads_need_main_connection():
+                    connection = self._read_connection()
+                else:
+                    connection = contextlib.nullcontext(self.conn)
+                
+                # For SELECT queries, use pandas to get an Arrow-backed DataFrame
+                with connection as conn:
+                    return _arrow_backed(_read_frame(sql_query, conn, limit))
             else:
                 # For DDL/DML queries (CREATE, INSERT, UPDATE, DELETE, etc.)
                 cursor = self.conn.cursor()
                 
                 # Handle multiple statements
-                statements = [stmt.strip() for stmt in sql_query.split(';') if stmt.strip()]
+                statements = split_statements(sql_query)
                 
                 if len(statements) > 1:
                     # Multiple statements - execute each one
                     for stmt in statements:
+                        self._track_pragma(stmt)
                         cursor.execute(stmt)
                 else:
                     # Single statement
@@ -135,8 +715,8 @@ class DatabaseManager:
                 
                 self.conn.commit()
                 
-                # Refresh tables list in case new tables were created
-                self._get_tables()
+                # Refresh tables list if the statements changed the schema
+                self._refresh_after_write()
                 
                 # Return success DataFrame for non-SELECT queries
                 return pd.DataFrame({'Result': ['Query executed successfully']})
@@ -144,57 +724,220 @@ class DatabaseManager:
         except Exception as e:
             raise Exception(f"Query execution failed: {e}")
     
+    def execute_write(self, sql_query):
+        """Execute a single data modification statement and return the number of affected rows."""
+        try:
+            cursor = self.conn.execute(sql_query.strip())
+            self.conn.commit()
+            
+            # Refresh tables list if the statement changed the schema
+            self._refresh_after_write()
+            
+            return cursor.rowcount
+        except Exception as e:
+            raise Exception(f"Query execution failed: {e}")
+    
+    def _run_query(self, query):
+        """Execute one query and wrap its outcome in a result entry."""
+        try:
+            result = self.execute_query(query)
+            return {'query': query, 'result': result, 'success': True}
+        except Exception as e:
+            return {'query': query, 'error': str(e), 'success': False}
+    
+    def _read_only_query(self, query):
+        """Execute a read-only query on a pooled connection so it can run alongside others."""
+        with self._read_connection() as conn:
+            return _read_frame(query, conn)
+    
+    def _run_read_query(self, query):
+        """Execute a read-only query and wrap its outcome in a result entry."""
+        try:
+            return {'query': query, 'result': _arrow_backed(self._read_only_query(query)), 'success': True}
+        except Exception as e:
+            return {'query': query, 'error': f"Query execution failed: {e}", 'success': False}
+    
+    def _run_merged_selects(self, queries, merged_sql):
+        """Execute several SELECTs as one merged query and split its rows back per query.
+        
+        Each query's DataFrame is built from its own raw rows, so its column types are
+        the ones it would get when run on its own.
+        """
+        with self._read_connection() as conn:
+            cursor = conn.execute(merged_sql)
+            columns = [col[0] for col in cursor.description]
+            rows = cursor.fetchall()
+        
+        # The flag columns marking each query's rows come after the selected columns
+        width = len(columns) - len(queries)
+        return [
+            {
+                'query': query,
+                'result': _arrow_backed(pd.DataFrame.from_records(
+                    [row[:width] for row in rows if row[width + index] == 1],
+                    columns=columns[:width],
+                    coerce_float=True
+                )),
+                'success': True
+            }
+            for index, query in enumerate(queries)
+        ]
+    
+    def _run_read_queries(self, queries):
+        """Execute read-only queries, merging SELECTs that differ only in a compared value.
+        
+        Remaining queries run concurrently on separate connections.
+        """
+        results = [None] * len(queries)
+        for positions, merged_sql in _plan_merged_selects(queries):
+            try:
+                entries = self._run_merged_selects([queries[i] for i in positions], merged_sql)
+            except Exception:
+                continue  # Run these queries one by one instead
+            for position, entry in zip(positions, entries):
+                results[position] = entry
+        
+        pending = [i for i, entry in enumerate(results) if entry is None]
+        if pending:
+            with ThreadPoolExecutor(max_workers=min(4, len(pending))) as executor:
+                for position, entry in zip(pending, executor.map(self._run_read_query, [queries[i] for i in pending])):
+                    results[position] = entry
+        return results
+    
     def execute_multiple_queries(self, sql_queries):
-        """Execute multiple SQL queries and return results for each."""
+        """Execute multiple SQL queries and return results for each.
+        
+        Consecutive read-only queries are merged where possible and otherwise run
+        concurrently on separate connections, everything else runs in order on the
+        main connection. Read-only queries also run in order on the main connection
+        while it has TEMP objects, attached databases or PRAGMA settings the other
+        connections cannot see.
+        """
         results = []
-        queries = [q.strip() for q in sql_queries.split(';') if q.strip()]
+        queries = split_statements(sql_queries)
         
-        for query in queries:
-            try:
-                result = self.execute_query(query)
-                results.append({'query': query, 'result': result, 'success': True})
-            except Exception as e:
-                results.append({'query': query, 'error': str(e), 'success': False})
+        for read_only, group in groupby(queries, key=lambda query: classify_statement(query) == READ):
+            group = list(group)
+            if read_only and len(group) > 1 and not self._reads_need_main_connection():
+                results.extend(self._run_read_queries(group))
+            else:
+                results.extend(self._run_query(query) for query in group)
         
         return results
     
     def get_db_schema_info(self):
         """Get comprehensive schema information for all tables."""
-        schema_info = {}
-        for table in self.tables:
-            # Get columns info
-            columns = self.get_table_schema(table)
-            
-            schema_info[table] = {
-                "columns": [col[1] for col in columns],
-                "primary_key": [col[1] for col in columns if col[5] == 1],
-                "column_types": {col[1]: col[2] for col in columns}
-            }
-            
-            # Get foreign keys
-            foreign_keys = self.get_foreign_keys(table)
-            if foreign_keys:
-                schema_info[table]["foreign_keys"] = [
-                    {"column": fk[3], "references": f"{fk[2]}.{fk[4]}"} for fk in foreign_keys
-                ]
+        return self._schema_info
+    
+    def _load_metrics(self):
+        """Load the catalog of materialized roll-up tables."""
+        self._metrics = {}
+        self._metric_lookup = {}
+        if METRIC_CATALOG_TABLE not in self.tables:
+            return
+        try:
+            cursor = self.conn.cursor()
+            cursor.execute(f"SELECT name, sql FROM {METRIC_CATALOG_TABLE};")
+            self._metrics = {name: sql for name, sql in cursor.fetchall()}
+            self._metric_lookup = {_normalize_sql(sql): name for name, sql in self._metrics.items()}
+            self._metrics_changes = self.conn.total_changes
+        except Exception as e:
+            raise Exception(f"Failed to load materialized metrics: {e}")
+    
+    def list_metrics(self):
+        """Get the names of all materialized metrics."""
+        return list(self._metrics)
+    
+    def list_stale_metrics(self):
+        """Get the names of materialized metrics whose last refresh failed, which are not used to answer queries."""
+        return [name for name in self._metrics if name in self._stale_metrics]
+    
+    def register_metric(self, name, sql_query):
+        """Materialize a query into an mv_<name> roll-up table and record it in the catalog."""
+        if not _METRIC_NAME_RE.match(name):
+            raise ValueError(f"Invalid metric name: {name}")
+        
+        sql_query = sql_query.strip().rstrip(";").strip()
+        try:
+            # Replacing an existing metric keeps its table and catalog entry if the new query fails
+            with self._transaction() as cursor:
+                cursor.execute(f"CREATE TABLE IF NOT EXISTS {METRIC_CATALOG_TABLE} (name TEXT PRIMARY KEY, sql TEXT NOT NULL);")
+                cursor.execute(f"DROP TABLE IF EXISTS mv_{name};")
+                cursor.execute(f"CREATE TABLE mv_{name} AS {sql_query};")
+                cursor.execute(
+                    f"INSERT OR REPLACE INTO {METRIC_CATALOG_TABLE} (name, sql) VALUES (?, ?);",
+                    (name, sql_query)
+                )
+        except Exception as e:
+            raise Exception(f"Failed to materialize metric {name}: {e}")
+        
+        self._get_tables()
+        self._load_metrics()
+        self._stale_metrics.discard(name)
+        return f"mv_{name}"
+    
+    def refresh_metric(self, name):
+        """Re-run the defining query of a materialized metric to bring it up to date."""
+        if name not in self._metrics:
+            raise ValueError(f"Unknown metric: {name}")
+        try:
+            with self._transaction() as cursor:
+                cursor.execute(f"DELETE FROM mv_{name};")
+                cursor.execute(f"INSERT INTO mv_{name} {self._metrics[name]};")
+        except Exception as e:
+            # The roll-up table keeps its old rows, which no longer match the data
+            self._stale_metrics.add(name)
+            raise Exception(f"Failed to refresh metric {name}: {e}")
+        self._stale_metrics.discard(name)
+    
+    def refresh_metrics(self):
+        """Refresh every materialized metric after the underlying data changed.
         
-        return schema_info
+        Returns {name: error} for the metrics that could not be refreshed, for example
+        because a source table was dropped. Those are flagged as stale and queries are
+        no longer rewritten to them until a later refresh succeeds.
+        """
+        failures = {}
+        for name in self._metrics:
+            try:
+                self.refresh_metric(name)
+            except Exception as e:
+                failures[name] = str(e)
+        self._metrics_changes = self.conn.total_changes
+        return failures
+    
+    def maybe_rewrite(self, sql_query):
+        """Rewrite a query to read from its materialized roll-up table when one matches and is up to date."""
+        if not self._metrics:
+            return sql_query
+        name = self._metric_lookup.get(_normalize_sql(sql_query))
+        if name is None or name in self._stale_metrics:
+            return sql_query
+        return f"SELECT * FROM mv_{name}"
     
     def get_sqlalchemy_url(self):
         """Get SQLAlchemy connection URL for the database."""
         return f"sqlite:///{self.file_path}"
     
+    def _backup_to(self, output_path):
+        """Copy the database page by page into another file with SQLite's online backup API.
+        
+        The copy gets the journal mode the database had before it was opened here, so
+        WAL is only kept for databases that used it already.
+        """
+        # Commit first so the copy includes changes made on this connection
+        self.conn.commit()
+        target = sqlite3.connect(output_path)
+        try:
+            self.conn.backup(target)
+            target.execute(f"PRAGMA journal_mode={self._journal_mode};")
+        finally:
+            target.close()
+    
     def save_database_to_file(self, output_path):
         """Save the current database to a specified file path."""
         try:
-            import shutil
-            
-            # Ensure all changes are committed
-            if self.conn:
-                self.conn.commit()
-            
-            # Copy the current database file to the output path
-            shutil.copy2(self.file_path, output_path)
+            self._backup_to(output_path)
             return True
         except Exception as e:
             raise Exception(f"Failed to save database to {output_path}: {e}")
@@ -202,19 +945,18 @@ class DatabaseManager:
     def get_database_as_bytes(self):
         """Get the database file as bytes for download."""
         try:
-            # Ensure all changes are committed
-            if self.conn:
-                self.conn.commit()
-            
-            with open(self.file_path, 'rb') as f:
-                return f.read()
+            # Copied through a file so the download gets the original journal mode
+            with tempfile.TemporaryDirectory() as temp_dir:
+                temp_path = os.path.join(temp_dir, "download.db")
+                self._backup_to(temp_path)
+                with open(temp_path, 'rb') as f:
+                    return f.read()
         except Exception as e:
             raise Exception(f"Failed to read database file: {e}")
     
     def backup_database(self, backup_path=None):
         """Create a backup of the current database."""
         try:
-            import shutil
             from datetime import datetime
             
             if backup_path is None:
@@ -223,11 +965,7 @@ class DatabaseManager:
                 base_name = os.path.splitext(os.path.basename(self.file_path))[0]
                 backup_path = f"{base_name}_backup_{timestamp}.db"
             
-            # Ensure all changes are committed
-            if self.conn:
-                self.conn.commit()
-            
-            shutil.copy2(self.file_path, backup_path)
+            self._backup_to(backup_path)
             return backup_path
         except Exception as e:
             raise Exception(f"Failed to create backup: {e}")
@@ -280,7 +1018,17 @@ class DatabaseManager:
                 conn.close()
             raise Exception(f"Failed to create database: {e}")
     
-    def __del__(self):
-        """Close connection when object is destroyed."""
-        if self.conn:
-            self.conn.close()
+    @property
+    def closed(self):
+        """Whether the database connection has been closed."""
+        return not self._finalizer.alive
+    
+    def close(self):
+        """Checkpoint and close the database connection."""
+        self._finalizer()
+    
+    def __enter__(self):
+        return self
+    
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
@@ -1,40 +1,77 @@
-from langchain.llms import OpenAI
-from langchain.chains import LLMChain
-from langchain.chat_models import ChatOpenAI
-from langchain.prompts import PromptTemplate
-from langchain_community.utilities import SQLDatabase
-from langchain.chains import create_sql_query_chain
 import requests
 import json
+import re
+import asyncio
+import importlib.util
 
-try:
-    from langchain_google_genai import ChatGoogleGenerativeAI
-    GEMINI_AVAILABLE = True
-except ImportError:
-    GEMINI_AVAILABLE = False
+# LangChain modules are imported where they are used, as importing them takes seconds.
+# Gemini support is optional, so only check that the package is installed.
+GEMINI_AVAILABLE = importlib.util.find_spec("langchain_google_genai") is not None
+
+# Markdown code fences around generated SQL (possibly unterminated), a sql-tagged one preferred,
+# and common answer prefixes
+_SQL_TAGGED_FENCE_RE = re.compile(r"```sql\b(.*?)(?:```|\Z)", re.DOTALL | re.IGNORECASE)
+_SQL_FENCE_RE = re.compile(r"```(?:sql\b)?(.*?)(?:```|\Z)", re.DOTALL | re.IGNORECASE)
+_SQL_PREFIX_RE = re.compile(r"^(?:SQLQuery|SQL|Query)\s*:\s*", re.IGNORECASE)
+
+# Number of generated SQL queries remembered per processor
+SQL_CACHE_SIZE = 256
 
 class LMStudioLLM:
     """Custom LLM wrapper for LM Studio local API."""
     def __init__(self, base_url="http://localhost:1234/v1"):
         self.base_url = base_url
         self.temperature = 0
+        
+        # Reuse one keep-alive connection for every request to the server
+        self.session = requests.Session()
+        self.session.headers.update({"Content-Type": "application/json"})
     
     def invoke(self, prompt):
         """Send request to LM Studio API."""
         try:
-            response = requests.post(
+            response = self.session.post(
                 f"{self.base_url}/chat/completions",
                 json={
                     "messages": [{"role": "user", "content": prompt}],
                     "temperature": self.temperature,
                     "max_tokens": 1000
-                },
-                headers={"Content-Type": "application/json"}
+                }
             )
             response.raise_for_status()
             return response.json()["choices"][0]["message"]["content"]
         except Exception as e:
             raise Exception(f"LM Studio API error: {str(e)}")
+    
+    def stream_invoke(self, prompt):
+        """Send request to LM Studio API and yield the response text as it is generated."""
+        try:
+            response = self.session.post(
+                f"{self.base_url}/chat/completions",
+                json={
+                    "messages": [{"role": "user", "content": prompt}],
+                    "temperature": self.temperature,
+                    "max_tokens": 1000,
+                    "stream": True
+                },
+                stream=True
+            )
+            # Check the status inside the block so the connection is returned to the pool on errors too
+            with response:
+                response.raise_for_status()
+                
+                # Server-sent events, one "data: {json}" line per chunk
+                for line in response.iter_lines():
+                    if not line.startswith(b"data:"):
+                        continue
+                    data = line[5:].strip()
+                    if data == b"[DONE]":
+                        break
+                    content = json.loads(data)["choices"][0].get("delta", {}).get("content")
+                    if content:
+                        yield content
+        except Exception as e:
+            raise Exception(f"LM Studio API error: {str(e)}")
 
 class TextToSQLProcessor:
     def __init__(self, db_manager, ai_config):
@@ -43,8 +80,15 @@ class TextToSQLProcessor:
         self.ai_config = ai_config
         self.llm = self._create_llm()
         
-        # Create SQLAlchemy database
-        self.db = SQLDatabase.from_uri(db_manager.get_sqlalchemy_url())
+        # The LangChain SQL database and chain are only needed by OpenAI and Gemini, so create them on first use
+        self.db = None
+        self._query_chain = None
+        
+        # Build the schema block once and reuse it for every prompt
+        self.schema_prompt = self.generate_tables_info()
+        
+        # Processors are rebuilt when the schema changes, so generated SQL can be reused for repeated questions
+        self._sql_cache = {}
     
     def _create_llm(self):
         """Create LLM instance based on configuration."""
@@ -53,6 +97,7 @@ class TextToSQLProcessor:
         api_key = self.ai_config["api_key"]
         
         if backend == "OpenAI":
+            from langchain.chat_models import ChatOpenAI
             return ChatOpenAI(
                 temperature=0, 
                 model_name=model, 
@@ -61,6 +106,7 @@ class TextToSQLProcessor:
         elif backend == "Gemini":
             if not GEMINI_AVAILABLE:
                 raise ImportError("langchain-google-genai package is required for Gemini support. Install with: pip install langchain-google-genai")
+            from langchain_google_genai import ChatGoogleGenerativeAI
             return ChatGoogleGenerativeAI(
                 model=model,
                 google_api_key=api_key,
@@ -73,31 +119,35 @@ class TextToSQLProcessor:
     
     def generate_tables_info(self):
         """Generate formatted information about database tables for the prompt."""
-        tables_info = ""
+        lines = []
         for table in self.db_manager.tables:
-            tables_info += f"Table: {table}\n"
+            lines.append(f"Table: {table}")
             schema = self.db_manager.get_table_schema(table)
-            for col in schema:
-                tables_info += f"  - {col[1]} ({col[2]})\n"
-            tables_info += "\n"
-        return tables_info
+            lines.extend(f"  - {col[1]} ({col[2]})" for col in schema)
+            lines.append("")
+        return "\n".join(lines) + "\n" if lines else ""
     
-    def process_query(self, query):
-        """Process a natural language query and return SQL, results, and explanation."""
+    def process_query(self, query, stream=None):
+        """Process a natural language query and return SQL, results, and explanation.
+        
+        If stream is given, LM Studio output is passed through it as it arrives, e.g.
+        st.write_stream, which must return the full text.
+        """
         try:
-            if self.ai_config["backend"] == "LM Studio":
-                # Handle LM Studio differently since it doesn't work with LangChain chains
-                sql_query = self._generate_sql_with_lm_studio(query)
-            else:
-                # Use LangChain for OpenAI and Gemini
-                query_chain = create_sql_query_chain(self.llm, self.db)
-                sql_query = query_chain.invoke({"question": query})
-            
-            # Clean up the SQL query (remove markdown formatting if present)
-            sql_query = self._clean_sql_query(sql_query)
+            # Generate SQL, or reuse what was generated for the same question
+            query = query.strip()
+            sql_query = self._sql_cache.get(query)
+            if sql_query is None:
+                sql_query = self._generate_sql(query, stream)
             
-            # Execute the query
-            result_df = self.db_manager.execute_query(sql_query)
+            # Execute the query, reading from a materialized roll-up table when one matches
+            try:
+                result_df = self.db_manager.execute_query(self.db_manager.maybe_rewrite(sql_query))
+            except Exception:
+                # Generate the SQL again next time instead of replaying a failing query
+                self._sql_cache.pop(query, None)
+                raise
+            self._remember_sql(query, sql_query)
             
             # Generate explanation if there are results
             explanation = None
@@ -108,39 +158,155 @@ class TextToSQLProcessor:
         except Exception as e:
             raise Exception(f"Error processing query with {self.ai_config['backend']}: {str(e)}")
     
-    def _generate_sql_with_lm_studio(self, query):
-        """Generate SQL query using LM Studio."""
-        schema_info = self.generate_tables_info()
+    def _generate_sql(self, query, stream=None):
+        """Generate a cleaned SQL query for a natural language question."""
+        if self.ai_config["backend"] == "LM Studio":
+            # Handle LM Studio differently since it doesn't work with LangChain chains
+            sql_query = self._generate_sql_with_lm_studio(query, stream)
+        else:
+            # Use LangChain for OpenAI and Gemini
+            query_chain = self._get_query_chain()
+            sql_query = query_chain.invoke({"question": query})
+        
+        # Clean up the SQL query (remove markdown formatting if present)
+        return self._clean_sql_query(sql_query)
+    
+    def _get_query_chain(self):
+        """Get the LangChain SQL query chain, creating it on first use."""
+        if self._query_chain is None:
+            from langchain.chains import create_sql_query_chain
+            from langchain_community.utilities import SQLDatabase
+            
+            # SQLAlchemy database built from the URL, with its own engine
+            self.db = SQLDatabase.from_uri(self.db_manager.get_sqlalchemy_url())
+            self._query_chain = create_sql_query_chain(self.llm, self.db)
+        return self._query_chain
+    
+    async def _agenerate_sql(self, query):
+        """Generate a cleaned SQL query without blocking, so several questions can wait on the LLM together."""
+        if self.ai_config["backend"] == "LM Studio":
+            # The LM Studio client is synchronous, so run it in a worker thread
+            sql_query = await asyncio.to_thread(self._generate_sql_with_lm_studio, query)
+        else:
+            # Use LangChain for OpenAI and Gemini
+            query_chain = self._get_query_chain()
+            sql_query = await query_chain.ainvoke({"question": query})
+        
+        return self._clean_sql_query(sql_query)
+    
+    def _remember_sql(self, query, sql_query):
+        """Remember SQL that ran successfully for a question, evicting the oldest entry when full."""
+        if query not in self._sql_cache and len(self._sql_cache) >= SQL_CACHE_SIZE:
+            self._sql_cache.pop(next(iter(self._sql_cache)))
+        self._sql_cache[query] = sql_query
+    
+    def process_many(self, questions):
+        """Generate SQL for several questions with one concurrent LLM call each and run each query."""
+        questions = [question.strip() for question in questions]
+        pending = [question for question in dict.fromkeys(questions) if question not in self._sql_cache]
+        
+        async def generate_all():
+            return await asyncio.gather(*(self._agenerate_sql(q) for q in pending), return_exceptions=True)
+        
+        generated = dict(zip(pending, asyncio.run(generate_all()) if pending else []))
+        results = self._run_generated(questions, [generated.get(q, self._sql_cache.get(q)) for q in questions])
+        
+        # Only remember SQL that ran, so a failing query is generated again next time
+        for result in results:
+            if result["success"]:
+                self._remember_sql(result["question"], result["sql"])
+            else:
+                self._sql_cache.pop(result["question"], None)
+        return results
+    
+    def process_batch(self, questions):
+        """Generate SQL for several questions with a single LLM call and run each query.
+        
+        Falls back to process_many if the response is not the requested JSON array.
+        """
+        try:
+            numbered_questions = [{"index": i, "question": q} for i, q in enumerate(questions)]
+            prompt = BATCH_SQL_GENERATION_TEMPLATE.format(
+                schema=self.schema_prompt,
+                questions=json.dumps(numbered_questions, indent=2)
+            )
+            response = self._invoke_llm(prompt)
+        except Exception as e:
+            raise Exception(f"Error processing batch with {self.ai_config['backend']}: {str(e)}")
+        
+        try:
+            sql_queries = self._parse_batch_response(response, len(questions))
+        except (ValueError, TypeError, AttributeError):
+            # Ask each question separately, concurrently
+            return self.process_many(questions)
+        
+        return self._run_generated(questions, sql_queries)
+    
+    def _run_generated(self, questions, sql_queries):
+        """Run the SQL generated for each question, where sql_queries holds SQL, None or an exception."""
+        results = []
+        for question, sql_query in zip(questions, sql_queries):
+            if isinstance(sql_query, Exception):
+                results.append({"question": question, "sql": None, "error": str(sql_query), "success": False})
+                continue
+            if not sql_query:
+                results.append({"question": question, "sql": None, "error": "No SQL was generated for this question", "success": False})
+                continue
+            sql_query = self._clean_sql_query(sql_query)
+            try:
+                result_df = self.db_manager.execute_query(self.db_manager.maybe_rewrite(sql_query))
+                results.append({"question": question, "sql": sql_query, "result": result_df, "success": True})
+            except Exception as e:
+                results.append({"question": question, "sql": sql_query, "error": str(e), "success": False})
+        
+        return results
+    
+    def _invoke_llm(self, prompt):
+        """Send a prompt to the configured LLM and return the response text."""
+        response = self.llm.invoke(prompt)
+        return getattr(response, "content", response)
+    
+    def _parse_batch_response(self, response, count):
+        """Parse a JSON array of {index, sql} objects into a list of SQL strings ordered by index."""
+        start, end = response.find("["), response.rfind("]")
+        if start == -1 or end < start:
+            raise ValueError("Response did not contain a JSON array")
+        
+        sql_queries = [None] * count
+        for item in json.loads(response[start:end + 1]):
+            index = item.get("index")
+            if isinstance(index, int) and 0 <= index < count:
+                sql_queries[index] = item.get("sql")
+        return sql_queries
+    
+    def _generate_sql_with_lm_studio(self, query, stream=None):
+        """Generate SQL query using LM Studio, optionally streaming the response through stream."""
         prompt = f"""You are an SQL expert. Convert the following natural language question into a valid SQLite SQL query.
 
 Database schema:
-{schema_info}
+{self.schema_prompt}
 
 Question: {query}
 
 Generate only the SQL query, no explanations or markdown formatting:"""
         
+        if stream is not None:
+            return stream(self.llm.stream_invoke(prompt))
         return self.llm.invoke(prompt)
     
     def _clean_sql_query(self, sql_query):
         """Clean SQL query by removing markdown formatting, prefixes, and extra whitespace."""
-        # Remove markdown code blocks
-        if "```sql" in sql_query:
-            sql_query = sql_query.split("```sql")[1].split("```")[0]
-        elif "```" in sql_query:
-            sql_query = sql_query.split("```")[1].split("```")[0]
-        
-        # Remove extra whitespace and newlines
-        sql_query = sql_query.strip()
+        # Remove markdown code blocks, taking a sql-tagged block over any earlier one
+        fence = _SQL_TAGGED_FENCE_RE.search(sql_query) or _SQL_FENCE_RE.search(sql_query)
+        if fence:
+            sql_query = fence.group(1)
         
-        # Remove common AI response prefixes
-        prefixes_to_remove = ["SQLQuery:", "SQL:", "Query:", "sql:", "query:"]
-        for prefix in prefixes_to_remove:
-            if sql_query.startswith(prefix):
-                sql_query = sql_query[len(prefix):].strip()
-                break
-        
-        return sql_query
+        # Remove extra whitespace, newlines and common AI response prefixes
+        return _SQL_PREFIX_RE.sub("", sql_query.strip(), count=1).strip()
+    
+    def _results_preview(self, result_df):
+        """Format the first 10 rows and columns of a result as compact CSV for a prompt."""
+        return result_df.head(10).iloc[:, :10].to_csv(index=False)
     
     def _generate_explanation(self, query, sql_query, result_df):
         """Generate an explanation of the query results."""
@@ -151,13 +317,16 @@ Generate only the SQL query, no explanations or markdown formatting:"""
 The SQL query executed was: {sql_query}
 
 The results were:
-{result_df.to_string(max_rows=10, max_cols=10)}
+{self._results_preview(result_df)}
 
 Please provide a concise explanation of these results in relation to the user's question."""
             
             return self.llm.invoke(prompt)
         else:
             # Use LangChain for OpenAI and Gemini
+            from langchain.chains import LLMChain
+            from langchain.prompts import PromptTemplate
+            
             explain_prompt = PromptTemplate(
                 input_variables=["query", "sql_query", "results"],
                 template="""
@@ -176,7 +345,7 @@ Please provide a concise explanation of these results in relation to the user's
             explanation = explanation_chain.run(
                 query=query,
                 sql_query=sql_query,
-                results=result_df.to_string(max_rows=10, max_cols=10)
+                results=self._results_preview(result_df)
             )
             
             return explanation
@@ -195,6 +364,20 @@ Generate a valid SQLite SQL query that answers the user's question.
 Only output the SQL query, nothing else.
 """
 
+BATCH_SQL_GENERATION_TEMPLATE = """
+You are an SQL expert. Your task is to convert several natural language questions into SQL queries.
+
+Database schema:
+{schema}
+
+User questions, as a JSON array:
+{questions}
+
+Return a JSON array; element i is SQL for question i. Each element must be an object of the form
+{{"index": <question index>, "sql": "<valid SQLite SQL query>"}}.
+Only output the JSON array, nothing else.
+"""
+
 SCHEMA_ANALYSIS_TEMPLATE = """
 Analyze the following database schema and identify potential relationships between tables:
 
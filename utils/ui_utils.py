@@ -1,115 +1,179 @@
 import streamlit as st
 import pandas as pd
 
+# Selectbox options, built once instead of on every rerun
+_BACKENDS = ("OpenAI", "Gemini", "LM Studio")
+_OPENAI_MODELS = ("gpt-5-mini-2025-08-07", "gpt-5-nano-2025-08-07", "gpt-oss-20b", "gpt-oss-120b", "gpt-5-2025-08-07")
+_GEMINI_MODELS = ("gemma-3n-e2b-it", "gemma-3-27b-it", "gemini-2.5-flash", "gemini-2.5-pro")
+_COL_TYPES = ("TEXT", "INTEGER", "REAL", "BLOB")
+
+# Static sidebar help, sent as a single element on every rerun
+_SIDEBAR_HELP_MD = """
+### About
+This app allows you to query databases using natural language.
+
+1. Configure your AI backend above
+2. Upload your .db, .sqlite, or .sql file in the 'Database Info' tab.
+3. View the tables, schema, and sample data.
+4. Switch to the 'Text to SQL' tab to ask questions in plain English.
+5. The app will convert your question to SQL and return the results.
+
+### Examples
+- 'Show me the top 5 most recent orders'
+- 'What is the average price of products in each category?'
+- 'Find all customers who made purchases above \\$100'
+- 'Count the number of orders per month in 2023'
+
+### Supported File Types
+- SQLite database files (.db, .sqlite, .sqlite3)
+- SQL script files (.sql)
+"""
+
 def create_sidebar():
     """Create the sidebar content."""
     with st.sidebar:
         st.subheader("AI Backend Configuration")
         
-        # Backend selection
+        # Backend selection, outside the form so the fields below match the chosen backend
         backend = st.selectbox(
             "Select AI Backend",
-            ["OpenAI", "Gemini", "LM Studio"],
+            _BACKENDS,
             key="ai_backend"
         )
         
-        # API key input based on backend
-        if backend == "OpenAI":
-            api_key = st.text_input("OpenAI API Key", type="password", key="openai_key")
-            model = st.selectbox(
-                "Model",
-                ["gpt-5-mini-2025-08-07", "gpt-5-nano-2025-08-07", "gpt-oss-20b", "gpt-oss-120b", "gpt-5-2025-08-07"],
-                key="openai_model"
-            )
-        elif backend == "Gemini":
-            api_key = st.text_input("Google API Key", type="password", key="gemini_key")
-            model = st.selectbox(
-                "Model",
-                ["gemma-3n-e2b-it", "gemma-3-27b-it", "gemini-2.5-flash", "gemini-2.5-pro"],
-                key="gemini_model"
-            )
-        else:  # LM Studio
-            api_key = None
-            lm_studio_url = st.text_input(
-                "LM Studio URL", 
-                value="http://localhost:1234/v1",
-                key="lm_studio_url"
-            )
-            st.info("Using currently loaded model in LM Studio")
-            model = "local-model"
+        # Backend settings only take effect when applied, instead of rerunning the app on every change
+        with st.form("ai_config_form"):
+            # API key input based on backend
+            if backend == "OpenAI":
+                api_key = st.text_input("OpenAI API Key", type="password", key="openai_key")
+                model = st.selectbox(
+                    "Model",
+                    _OPENAI_MODELS,
+                    key="openai_model"
+                )
+            elif backend == "Gemini":
+                api_key = st.text_input("Google API Key", type="password", key="gemini_key")
+                model = st.selectbox(
+                    "Model",
+                    _GEMINI_MODELS,
+                    key="gemini_model"
+                )
+            else:  # LM Studio
+                api_key = None
+                lm_studio_url = st.text_input(
+                    "LM Studio URL", 
+                    value="http://localhost:1234/v1",
+                    key="lm_studio_url"
+                )
+                st.info("Using currently loaded model in LM Studio")
+                model = "local-model"
+            
+            applied = st.form_submit_button("Apply Configuration")
         
-        # Store configuration in session state
-        st.session_state.ai_config = {
-            "backend": backend,
-            "api_key": api_key,
-            "model": model,
-            "lm_studio_url": lm_studio_url if backend == "LM Studio" else None
-        }
+        # Store configuration in session state when applied, starting from the defaults
+        if applied or "ai_config" not in st.session_state:
+            st.session_state.ai_config = {
+                "backend": backend,
+                "api_key": api_key,
+                "model": model,
+                "lm_studio_url": lm_studio_url if backend == "LM Studio" else None
+            }
+        st.caption(f"Active: {st.session_state.ai_config['backend']} ({st.session_state.ai_config['model']})")
         
         st.divider()
         
-        st.subheader("About")
-        st.write("This app allows you to query databases using natural language.")
-        st.write("1. Configure your AI backend above")
-        st.write("2. Upload your .db, .sqlite, or .sql file in the 'Database Info' tab.")
-        st.write("3. View the tables, schema, and sample data.")
-        st.write("4. Switch to the 'Text to SQL' tab to ask questions in plain English.")
-        st.write("5. The app will convert your question to SQL and return the results.")
-        
-        st.subheader("Examples")
-        st.write("- 'Show me the top 5 most recent orders'")
-        st.write("- 'What is the average price of products in each category?'")
-        st.write("- 'Find all customers who made purchases above $100'")
-        st.write("- 'Count the number of orders per month in 2023'")
-        
-        st.subheader("Supported File Types")
-        st.write("- SQLite database files (.db, .sqlite, .sqlite3)")
-        st.write("- SQL script files (.sql)")
+        st.markdown(_SIDEBAR_HELP_MD)
 
-def display_table_info(db_manager, table):
-    """Display information about a single table."""
-    st.write(f"### Table: {table}")
-    
-    # Get schema for the table
-    schema = db_manager.get_table_schema(table)
-    
-    # Create and display schema DataFrame
-    schema_df = pd.DataFrame(schema, columns=["cid", "name", "type", "notnull", "default_value", "pk"])
-    st.write("Schema:")
-    st.dataframe(schema_df[["name", "type", "pk"]])
+# Widest table preview sent to the browser
+PREVIEW_MAX_COLUMNS = 50
+
+@st.cache_data(ttl=3600, show_spinner=False)
+def load_table_bundles(file_path, mtime, _db_manager):
+    """Load schema, preview and row count of every table once per database file version."""
+    return _db_manager.get_table_bundles()
+
+def display_table_info(db_manager, table, bundle=None, expanded=False):
+    """Display information about a single table in an expander, collapsed by default."""
+    # Skip tables that no longer exist before reading anything from the database
+    if not db_manager.has_table(table):
+        st.warning(f"Table '{table}' no longer exists in the database.")
+        return
     
-    # Display sample data
-    try:
-        data_df = db_manager.get_table_preview(table)
-        st.write("Preview (First 5 rows):")
-        st.dataframe(data_df)
+    with st.expander(f"Table: {table}", expanded=expanded):
+        # Get schema, preview and row count for the table, reusing the cached bundles of this database version
+        if bundle is None:
+            bundle = load_table_bundles(db_manager.file_path, db_manager.get_mtime(), db_manager).get(table)
+        if bundle is None:
+            bundle = db_manager.get_table_bundles([table])[table]
+        schema = bundle["schema"]
         
-        # Display row count
-        count = db_manager.get_row_count(table)
-        st.write(f"Total rows: {count}")
-    except Exception as e:
-        st.error(f"Error reading data from {table}: {e}")
+        # Create and display schema DataFrame with only the displayed columns
+        schema_df = pd.DataFrame([(col[1], col[2], col[5]) for col in schema], columns=["name", "type", "pk"])
+        st.write("Schema:")
+        # The schema is a handful of rows, so a static table is enough
+        st.table(schema_df)
+        
+        # Display sample data
+        if "error" in bundle:
+            st.error(f"Error reading data from {table}: {bundle['error']}")
+        else:
+            st.write("Preview (First 5 rows):")
+            preview_df = bundle["preview"].head(5)
+            if len(preview_df.columns) > PREVIEW_MAX_COLUMNS:
+                st.warning(f"Showing the first {PREVIEW_MAX_COLUMNS} of {len(preview_df.columns)} columns")
+                preview_df = preview_df.iloc[:, :PREVIEW_MAX_COLUMNS]
+            st.dataframe(preview_df)
+            
+            # Display row count
+            st.write(f"Total rows: {bundle['count']}")
+
+@st.cache_data(max_entries=8, show_spinner=False)
+def _render_schema_markdown(schema_key, _schema_info):
+    """Build the schema overview as one markdown string, once per database schema."""
+    lines = []
+    for table, info in _schema_info.items():
+        lines.append(f"### Table: {table}")
+        lines.append(f"Columns: {', '.join(info['columns'])}")
+        if info['primary_key']:
+            lines.append(f"Primary Key: {', '.join(info['primary_key'])}")
+        if 'foreign_keys' in info and info['foreign_keys']:
+            lines.append("Foreign Keys:")
+            lines.append("\n".join(f"- {fk['column']} → {fk['references']}" for fk in info['foreign_keys']))
+    return "\n\n".join(lines)
 
 def display_schema_overview(db_manager):
     """Display a comprehensive overview of the database schema."""
-    schema_info = db_manager.get_db_schema_info()
-    
     st.subheader("Database Schema Overview")
-    for table, info in schema_info.items():
-        st.write(f"### Table: {table}")
-        st.write(f"Columns: {', '.join(info['columns'])}")
-        if info['primary_key']:
-            st.write(f"Primary Key: {', '.join(info['primary_key'])}")
-        if 'foreign_keys' in info and info['foreign_keys']:
-            st.write("Foreign Keys:")
-            for fk in info['foreign_keys']:
-                st.write(f"  - {fk['column']} → {fk['references']}")
+    # The overview is sent as a single element and only rebuilt when the schema changes
+    overview_md = _render_schema_markdown(
+        db_manager.schema_key,
+        db_manager.get_db_schema_info()
+    )
+    if overview_md:
+        st.markdown(overview_md)
+
+# Tables being designed are listed in collapsed expanders when there are more than this
+COLLAPSE_TABLES_OVER = 20
+
+# Column flag suffixes keyed by (primary_key, not_null)
+_FLAG_STRINGS = {
+    (False, False): "",
+    (True, False): " (PK)",
+    (False, True): " (NOT NULL)",
+    (True, True): " (PK, NOT NULL)",
+}
+
+def _columns_markdown(table):
+    """Format the columns of a table being designed as a markdown bullet list."""
+    return "\n".join(
+        f"- {col['name']}: {col['type']}{_FLAG_STRINGS[(col['primary_key'], col['not_null'])]}"
+        for col in table["columns"]
+    )
 
 def create_new_database_form():
     """Display form for creating a new database."""
-    # Initialize session state for tables if not exists
-    if "new_db_tables" not in st.session_state:
-        st.session_state.new_db_tables = []
+    # Initialize session state for tables if not exists, keyed by table name in insertion order
+    tables = st.session_state.setdefault("new_db_tables", {})
     
     # Database name input (outside form for persistence)
     db_name = st.text_input("Database Name", placeholder="my_database", key="db_name_input")
@@ -127,7 +191,7 @@ def create_new_database_form():
         with col1:
             column_name = st.text_input("Column Name", key="column_name_input")
         with col2:
-            column_type = st.selectbox("Type", ["TEXT", "INTEGER", "REAL", "BLOB"], key="column_type_input")
+            column_type = st.selectbox("Type", _COL_TYPES, key="column_type_input")
         with col3:
             is_primary = st.checkbox("Primary Key", key="is_primary_input")
         with col4:
@@ -142,54 +206,41 @@ def create_new_database_form():
         if add_column:
             if column_name and table_name:
                 # Find or create table in session state
-                table_found = False
-                for table in st.session_state.new_db_tables:
-                    if table["name"] == table_name:
-                        table["columns"].append({
-                            "name": column_name,
-                            "type": column_type,
-                            "primary_key": is_primary,
-                            "not_null": not_null
-                        })
-                        table_found = True
-                        break
+                table = tables.get(table_name)
+                if table is None:
+                    table = {"name": table_name, "columns": []}
+                    tables[table_name] = table
                 
-                if not table_found:
-                    st.session_state.new_db_tables.append({
-                        "name": table_name,
-                        "columns": [{
-                            "name": column_name,
-                            "type": column_type,
-                            "primary_key": is_primary,
-                            "not_null": not_null
-                        }]
-                    })
+                table["columns"].append({
+                    "name": column_name,
+                    "type": column_type,
+                    "primary_key": is_primary,
+                    "not_null": not_null
+                })
                 
+                # The table listing below is rendered after this handler, so no extra rerun is needed
                 st.success(f"Added column '{column_name}' to table '{table_name}'")
-                st.rerun()
             else:
                 st.error("Please provide both table name and column name.")
-        
-        if clear_tables:
-            st.session_state.new_db_tables = []
-            st.rerun()
+        elif clear_tables:
+            # Clear in place so the local binding still refers to the session state dict
+            tables.clear()
     
-    # Display current tables and columns
-    if st.session_state.new_db_tables:
-        st.write("**Current Tables:**")
-        for table in st.session_state.new_db_tables:
-            st.write(f"**{table['name']}**")
-            for col in table["columns"]:
-                flags = []
-                if col["primary_key"]:
-                    flags.append("PK")
-                if col["not_null"]:
-                    flags.append("NOT NULL")
-                flag_str = f" ({', '.join(flags)})" if flags else ""
-                st.write(f"  - {col['name']}: {col['type']}{flag_str}")
+    # Display current tables and columns with one markdown element, or collapsed per table when there are many
+    if tables:
+        if len(tables) > COLLAPSE_TABLES_OVER:
+            st.write("**Current Tables:**")
+            for table in tables.values():
+                with st.expander(table["name"]):
+                    st.markdown(_columns_markdown(table))
+        else:
+            st.markdown("\n\n".join(
+                ["**Current Tables:**"] +
+                [f"**{table['name']}**\n{_columns_markdown(table)}" for table in tables.values()]
+            ))
     
     # Return the current state
-    if db_name and st.session_state.new_db_tables:
-        return db_name, st.session_state.new_db_tables
+    if db_name and tables:
+        return db_name, list(tables.values())
     else:
         return None, None
\ No newline at end of file